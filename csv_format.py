@@ -0,0 +1,20 @@
+"""
+CSV Formatting Helpers
+
+Formats uint8 pixel data as the legacy encrypted-image CSV text. This module
+has no third-party imports, so worker processes started by img_encrypt.py
+can import it quickly.
+
+Author: Mohammad Shadman Khan
+"""
+
+# Pre-encoded decimal text for every uint8 value
+CSV_TOKENS = [str(i).encode() for i in range(256)]
+
+def format_csv_rows(data: bytes, channels: int) -> bytes:
+    """
+    Format raw uint8 pixel bytes as CSV lines, one pixel of `channels` values per line.
+    """
+    tokens = [CSV_TOKENS[v] for v in data]
+    return b''.join(b','.join(tokens[i:i + channels]) + b'\n'
+                    for i in range(0, len(tokens), channels))
@@ -15,10 +15,21 @@ import logging
 import time
 import tkinter as tk
 from tkinter import filedialog
+from PIL import Image
+from lut_apply import apply_lut, select_lut_backend
 
 # Configure logging with more details
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Set the PROFILE environment variable to log how long each step takes
+PROFILE = os.environ.get('PROFILE', '').strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+# Hidden Tk root shared by all file dialogs, created on first use
+_root = None
+
+# Number of image rows decrypted per block when streaming from the encrypted file
+DECRYPT_CHUNK_ROWS = 256
+
 # Function to display image
 def display_image(img: np.ndarray, title: str):
     """
@@ -28,41 +39,63 @@ def display_image(img: np.ndarray, title: str):
     plt.imshow(img)
     plt.show()
 
-# Function to validate key
-def validate_key(key):
+# Function to validate a single permutation key
+def validate_permutation(key):
     """
-    Validate that the key is a permutation of integers from 0 to 255.
+    Validate that a 1-D key is a permutation of integers from 0 to 255.
     """
-    logging.info("Validating key...")
-    if len(key) != 256:
-        raise ValueError(f"Key length is {len(key)}, expected 256")
+    key_arr = np.asarray(key)
+    if key_arr.ndim != 1:
+        raise ValueError(f"Key has {key_arr.ndim} dimensions, expected 1")
+    if len(key_arr) != 256:
+        raise ValueError(f"Key length is {len(key_arr)}, expected 256")
     
-    sorted_key = sorted(key)
-    expected_range = list(range(256))
-    if sorted_key != expected_range:
+    # Count occurrences of each value in a single O(N) pass
+    in_range = key_arr[(key_arr >= 0) & (key_arr <= 255)]
+    counts = np.bincount(in_range, minlength=256)
+    if not np.all(counts == 1):
         # Find differences for better error reporting
-        missing = set(expected_range) - set(sorted_key)
-        duplicates = [x for x in sorted_key if sorted_key.count(x) > 1]
-        if missing:
-            raise ValueError(f"Key is missing values: {missing}")
-        if duplicates:
-            raise ValueError(f"Key has duplicate values: {set(duplicates)}")
+        missing = np.flatnonzero(counts == 0)
+        duplicates = np.flatnonzero(counts > 1)
+        if missing.size:
+            raise ValueError(f"Key is missing values: {set(missing.tolist())}")
+        if duplicates.size:
+            raise ValueError(f"Key has duplicate values: {set(duplicates.tolist())}")
         raise ValueError("Key is not a valid permutation of integers from 0 to 255")
-    
+
+# Function to validate key
+def validate_key(key):
+    """
+    Validate that the key is a permutation of integers from 0 to 255, or a
+    (3, 256) array holding one such permutation per colour channel.
+    """
+    logging.info("Validating key...")
+    key_arr = np.asarray(key)
+    if key_arr.ndim == 2:
+        if key_arr.shape[0] != 3:
+            raise ValueError(f"Per-channel key has {key_arr.shape[0]} rows, expected 3")
+        for channel in range(3):
+            try:
+                validate_permutation(key_arr[channel])
+            except ValueError as e:
+                raise ValueError(f"Channel {channel}: {e}") from None
+    else:
+        validate_permutation(key_arr)
+
     logging.info("Key validation successful")
 
 # Function to load key from file
 def load_key_from_file(filename):
     """
-    Load the key from a text file.
+    Load the key from a text file as an integer array.
+    A file with one line per colour channel gives a (3, 256) per-channel key.
     """
     logging.info(f"Loading key from {filename}")
     try:
-        with open(filename, 'r') as file:
-            key_string = file.read().strip()
-            key = [int(s.strip()) for s in key_string.split(',')]
-            logging.info(f"Key loaded, length: {len(key)}")
-            return key
+        # Parse straight into an array; int16 keeps out-of-range values visible to validate_key
+        key = np.loadtxt(filename, delimiter=',', dtype=np.int16, ndmin=1)
+        logging.info(f"Key loaded, shape: {key.shape}")
+        return key
     except Exception as e:
         logging.error(f"Error loading key: {e}")
         raise
@@ -77,21 +110,50 @@ def load_image_from_csv(filename):
         logging.error(f"File not found at {filename}")
         return None, None, None
     try:
-        start_time = time.time()
-        with open(filename, 'r') as file:
-            # Read dimensions from the first line
-            line = file.readline().strip()
-            rows, cols = map(int, line.split(','))
-            logging.info(f"Image dimensions: {rows}x{cols}")
-
-            # Load the flattened image data
-            logging.info("Loading image data...")
-            img_flat = np.loadtxt(file, delimiter=',', dtype=int)
+        if PROFILE:
+            start_time = time.time()
+        # Read dimensions from the first line
+        with open(filename, 'rb') as file:
+            line = file.readline().decode().strip()
+        rows, cols = map(int, line.split(','))
+        logging.info(f"Image dimensions: {rows}x{cols}")
+
+        # Load the flattened image data (NumPy >= 1.23 parses this in C).
+        # Passing the path rather than an open file lets loadtxt read the file
+        # in bulk blocks instead of iterating it line by line in Python.
+        img_flat = np.loadtxt(filename, delimiter=',', dtype=np.uint8, skiprows=1)
+        if PROFILE:
             logging.info(f"Image data loaded in {time.time() - start_time:.2f} seconds")
 
-            # Reshape to original dimensions
-            img = img_flat.reshape((rows, cols, 3))
-            logging.info("Image reshaped successfully")
+        # Reshape to original dimensions
+        img = img_flat.reshape((rows, cols, 3))
+
+        return img, rows, cols
+    except Exception as e:
+        logging.error(f"Error loading image: {e}")
+        return None, None, None
+
+# Function to load image from NPY file
+def load_image_from_npy(filename):
+    """
+    Load an image from a binary NumPy (.npy) file.
+    """
+    logging.info(f"Loading image from {filename}")
+    if not os.path.exists(filename):
+        logging.error(f"File not found at {filename}")
+        return None, None, None
+    try:
+        if PROFILE:
+            start_time = time.time()
+        # Memory-map the file so pixels are paged in on demand instead of copied
+        img = np.load(filename, mmap_mode='r')
+        # Encrypted images are always saved as uint8 RGB; anything else would
+        # decrypt to garbage rather than fail, so reject it here
+        validate_image(img)
+        rows, cols = img.shape[:2]
+        logging.info(f"Image dimensions: {rows}x{cols}")
+        if PROFILE:
+            logging.info(f"Image data loaded in {time.time() - start_time:.2f} seconds")
 
         return img, rows, cols
     except Exception as e:
@@ -101,7 +163,9 @@ def load_image_from_csv(filename):
 # Function to validate image
 def validate_image(img):
     """
-    Validate that the image has 3 channels and pixel values are in the range [0, 255].
+    Validate that the image is a 3-channel uint8 array that the inverse
+    key can be applied to. uint8 data is always in the range [0, 255],
+    so no value scan is needed.
     """
     logging.info("Validating image...")
     if not isinstance(img, np.ndarray):
@@ -113,29 +177,65 @@ def validate_image(img):
     if img.shape[-1] != 3:
         raise ValueError(f"Image has {img.shape[-1]} channels, expected 3")
     
-    min_val = np.min(img)
-    max_val = np.max(img)
-    if min_val < 0 or max_val > 255:
-        raise ValueError(f"Image data values out of range. Min: {min_val}, Max: {max_val}")
+    if img.dtype != np.uint8:
+        raise ValueError(f"Image has dtype {img.dtype}, expected uint8")
     
     logging.info("Image validation successful")
 
+# Function to decrypt image with a per-channel key
+def decrypt_image_per_channel(img, keys):
+    """
+    Decrypt the image with a (3, 256) key, one permutation per colour channel.
+    """
+    # Inverse tables for all channels in one scatter: inverse_luts[c, keys[c, i]] = i
+    inverse_luts = np.empty((3, 256), dtype=np.uint8)
+    inverse_luts[np.arange(3)[:, None], keys] = np.arange(256, dtype=np.uint8)
+
+    # Split into (3, rows, cols) planes so each channel's lookup is unit-stride
+    backend = select_lut_backend(img)
+    img_soa = np.ascontiguousarray(np.transpose(img, (2, 0, 1)))
+    out_soa = np.empty_like(img_soa)
+    for channel in range(3):
+        apply_lut(img_soa[channel], inverse_luts[channel], out=out_soa[channel], backend=backend)
+    # Back to (rows, cols, 3) for display and saving
+    return np.ascontiguousarray(out_soa.transpose(1, 2, 0))
+
 # Function to decrypt image
 def decrypt_image(img, key):
     """
     Decrypt the image using the provided key.
+    A (3, 256) per-channel key decrypts each colour plane with its own table.
     """
     logging.info("Starting image decryption...")
-    start_time = time.time()
+    if PROFILE:
+        start_time = time.time()
     
     try:
-        # Create inverse key mapping
-        inverse_key = {v: i for i, v in enumerate(key)}
-        logging.info("Inverse key mapping created")
-        
-        # Apply decryption
-        img1_loaded = np.vectorize(inverse_key.get)(img)
-        logging.info(f"Image decryption completed in {time.time() - start_time:.2f} seconds")
+        key_arr = np.asarray(key, dtype=np.uint8)
+        if key_arr.ndim == 2:
+            img1_loaded = decrypt_image_per_channel(img, key_arr)
+            if PROFILE:
+                logging.info(f"Image decryption completed in {time.time() - start_time:.2f} seconds")
+            return img1_loaded
+
+        # Create inverse key lookup table: inverse_lut[key[i]] = i
+        inverse_lut = np.empty(256, dtype=np.uint8)
+        inverse_lut[key_arr] = np.arange(256, dtype=np.uint8)
+
+        # Stream row blocks from the (possibly memory-mapped) input straight
+        # into one preallocated output, so no full-size intermediate is created
+        img1_loaded = np.empty(img.shape, dtype=np.uint8)
+        backend = select_lut_backend(img)
+        if backend == 'gpu':
+            # One upload of the table and the image, one copy back; blocking
+            # would repeat the synchronous transfers for every block
+            apply_lut(img, inverse_lut, out=img1_loaded, backend=backend)
+        else:
+            for start in range(0, img.shape[0], DECRYPT_CHUNK_ROWS):
+                stop = start + DECRYPT_CHUNK_ROWS
+                apply_lut(img[start:stop], inverse_lut, out=img1_loaded[start:stop], backend=backend)
+        if PROFILE:
+            logging.info(f"Image decryption completed in {time.time() - start_time:.2f} seconds")
         
         return img1_loaded
     except Exception as e:
@@ -148,75 +248,47 @@ def save_image_as_png(img: np.ndarray, png_path: str):
     """
     logging.info(f"Saving image to {png_path}")
     try:
-        start_time = time.time()
-        img_to_save = np.clip(img, 0, 255).astype(np.uint8)
-        plt.imsave(png_path, img_to_save)
-        logging.info(f"Image saved successfully in {time.time() - start_time:.2f} seconds")
+        if PROFILE:
+            start_time = time.time()
+        # uint8 input is already in range; anything else is clipped and cast in one pass
+        if img.dtype == np.uint8:
+            img_to_save = img
+        else:
+            img_to_save = np.clip(img, 0, 255, out=np.empty(img.shape, dtype=np.uint8), casting='unsafe')
+        # Write RGB directly with Pillow; plt.imsave would upcast to RGBA
+        Image.fromarray(img_to_save).save(png_path, format='PNG', compress_level=1)
+        if PROFILE:
+            logging.info(f"Image saved successfully in {time.time() - start_time:.2f} seconds")
     except Exception as e:
         logging.error(f"Failed to save image as PNG: {e}")
         raise
 
+def get_root():
+    """
+    Return the hidden Tk root window shared by all file dialogs.
+    """
+    global _root
+    if _root is None:
+        _root = tk.Tk()
+        _root.attributes('-topmost', True)  # Make sure dialogs appear on top
+        _root.withdraw()  # Hide the main window
+    return _root
+
 def select_directory(title):
     """
     Open a dialog to select a directory.
     """
-    root = tk.Tk()
-    root.attributes('-topmost', True)  # Make sure dialog appears on top
-    root.withdraw()  # Hide the main window
-    
-    # Force focus on the dialog
+    root = get_root()
     root.focus_force()
-    
-    # Use a callback to ensure the dialog is shown
-    def open_dialog():
-        directory = filedialog.askdirectory(title=title, parent=root)
-        root.directory = directory
-        root.quit()
-    
-    # Schedule the dialog to open after the main loop starts
-    root.after(100, open_dialog)
-    
-    # Start the main loop
-    root.mainloop()
-    
-    # Get the selected directory
-    directory = getattr(root, 'directory', '')
-    
-    # Destroy the root window
-    root.destroy()
-    
-    return directory
+    return filedialog.askdirectory(title=title, parent=root)
 
 def select_file(title, filetypes):
     """
     Open a dialog to select a file.
     """
-    root = tk.Tk()
-    root.attributes('-topmost', True)  # Make sure dialog appears on top
-    root.withdraw()  # Hide the main window
-    
-    # Force focus on the dialog
+    root = get_root()
     root.focus_force()
-    
-    # Use a callback to ensure the dialog is shown
-    def open_dialog():
-        file_path = filedialog.askopenfilename(title=title, filetypes=filetypes, parent=root)
-        root.file_path = file_path
-        root.quit()
-    
-    # Schedule the dialog to open after the main loop starts
-    root.after(100, open_dialog)
-    
-    # Start the main loop
-    root.mainloop()
-    
-    # Get the selected file path
-    file_path = getattr(root, 'file_path', '')
-    
-    # Destroy the root window
-    root.destroy()
-    
-    return file_path
+    return filedialog.askopenfilename(title=title, filetypes=filetypes, parent=root)
 
 def main():
     try:
@@ -251,9 +323,13 @@ def main():
             exit(1)
         logging.info(f"Selected directory: {img_dir}")
 
-        # Load the encrypted image
+        # Load the encrypted image, falling back to the legacy CSV format
+        npy_path = os.path.join(img_dir, "encrypted_image.npy")
         csv_path = os.path.join(img_dir, "encrypted_image.csv")
-        img1_loaded, _, _ = load_image_from_csv(csv_path)
+        if os.path.exists(npy_path):
+            img1_loaded, _, _ = load_image_from_npy(npy_path)
+        else:
+            img1_loaded, _, _ = load_image_from_csv(csv_path)
         if img1_loaded is None:
             logging.error("Failed to load image")
             print("Failed to load image.")
@@ -263,7 +339,6 @@ def main():
         try:
             logging.info("Starting decryption process")
             img3 = decrypt_image(img1_loaded, key)
-            validate_image(img3)
         except (ValueError, KeyError) as e:
             logging.error(f"Decryption error: {e}")
             print(f"Error: {e}")
@@ -7,30 +7,54 @@ The encrypted image and key are saved for later decryption.
 Author: Mohammad Shadman Khan
 """
 
-from typing import List
 import matplotlib.pyplot as plt
 import numpy as np
-import random
 import logging
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import tkinter as tk
 from tkinter import filedialog
+from PIL import Image
+from lut_apply import apply_lut, select_lut_backend
+from csv_format import format_csv_rows
 
 # Configure logging with more details
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Set the PROFILE environment variable to log how long each step takes
+PROFILE = os.environ.get('PROFILE', '').strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+# Hidden Tk root shared by all file dialogs, created on first use
+_root = None
+
+# Also write the legacy CSV format for consumers that cannot read .npy files
+WRITE_LEGACY_CSV = False
+
+# Pixels formatted per CSV block
+_CSV_CHUNK_ROWS = 4096
+
+# Pixel count above which CSV formatting is spread across worker processes.
+# Serial formatting costs ~0.3 us/pixel; starting spawn workers costs ~0.1 s, or
+# ~0.65 s when they re-import this script as __main__. With N workers the pool
+# pays off once pixels * 0.3 us * (1 - 1/N) exceeds that, which for the worst
+# case is ~2.9M pixels at N=4 and ~4.3M at N=2.
+CSV_PARALLEL_MIN_PIXELS = 1 << 22
+
 def load_image(img_path: str) -> np.ndarray:
     """
     Load an image from a file path and ensure it's in uint8 format.
     """
     logging.info(f"Loading image from {img_path}")
     try:
-        start_time = time.time()
+        if PROFILE:
+            start_time = time.time()
         img = plt.imread(img_path)
         if img.dtype != np.uint8:
             img = (img * 255).astype(np.uint8)
-        logging.info(f"Image loaded successfully in {time.time() - start_time:.2f} seconds")
+        if PROFILE:
+            logging.info(f"Image loaded successfully in {time.time() - start_time:.2f} seconds")
         return img
     except Exception as e:
         logging.error(f"Failed to load image: {e}")
@@ -45,50 +69,70 @@ def display_image(img: np.ndarray, title: str):
     plt.imshow(img)
     plt.show()
 
-def generate_key() -> List[int]:
+def generate_key() -> np.ndarray:
     """
     Generate a random permutation of integers from 0 to 255 for encryption.
     """
     logging.info("Generating encryption key")
-    start_time = time.time()
-    key = list(range(256))
-    random.shuffle(key)
-    logging.info(f"Key generated in {time.time() - start_time:.2f} seconds")
+    if PROFILE:
+        start_time = time.time()
+    # Returned as uint8 so it can be used as a lookup table without a copy
+    key = np.random.default_rng().permutation(256).astype(np.uint8)
+    if PROFILE:
+        logging.info(f"Key generated in {time.time() - start_time:.2f} seconds")
     return key
 
-def save_key_to_file(key: List[int], file_path: str):
+def save_key_to_file(key: np.ndarray, file_path: str):
     """
     Save the key to a text file.
+    A (3, 256) per-channel key is written as one line per colour channel.
     """
     logging.info(f"Saving key to {file_path}")
     try:
-        start_time = time.time()
-        key_string = ', '.join(map(str, key))
+        if PROFILE:
+            start_time = time.time()
+        key_string = '\n'.join(', '.join(map(str, row)) for row in np.atleast_2d(key).tolist())
         with open(file_path, 'w') as file:
             file.write(key_string)
-        logging.info(f"Key saved successfully in {time.time() - start_time:.2f} seconds")
+        if PROFILE:
+            logging.info(f"Key saved successfully in {time.time() - start_time:.2f} seconds")
     except Exception as e:
         logging.error(f"Failed to save key: {e}")
         raise
 
-def encrypt_image(img: np.ndarray, key: List[int]) -> np.ndarray:
+def encrypt_image(img: np.ndarray, key: np.ndarray, layout: str = 'aos') -> np.ndarray:
     """
     Encrypt the image using the given key.
+    With layout='soa' each channel is processed as a contiguous plane, and the
+    key may also be a (3, 256) array holding a separate key per channel.
     """
     logging.info("Starting image encryption")
-    start_time = time.time()
+    if PROFILE:
+        start_time = time.time()
     
     try:
-        rows, cols = img.shape[:2]
-        logging.info(f"Image dimensions: {rows}x{cols}")
-        
-        img1 = np.zeros((rows, cols, 3), dtype=int)
-        for i in range(rows):
-            for j in range(cols):
-                for k in range(3):
-                    img1[i][j][k] = key[img[i][j][k]]
-        
-        logging.info(f"Image encryption completed in {time.time() - start_time:.2f} seconds")
+        if layout == 'aos':
+            # Apply the key as a lookup table over the RGB channels in one pass
+            lut = np.asarray(key, dtype=np.uint8)
+            if lut.ndim != 1:
+                raise ValueError("Per-channel keys require layout='soa'")
+            img1 = apply_lut(img[:, :, :3], lut)
+        elif layout == 'soa':
+            luts = np.broadcast_to(np.asarray(key, dtype=np.uint8), (3, 256))
+            # Pick the backend once for the whole image rather than per plane
+            backend = select_lut_backend(img[:, :, :3])
+            # Split into (3, rows, cols) planes so each channel's lookup is unit-stride
+            img_soa = np.ascontiguousarray(img[:, :, :3].transpose(2, 0, 1))
+            out_soa = np.empty_like(img_soa)
+            for channel in range(3):
+                apply_lut(img_soa[channel], luts[channel], out=out_soa[channel], backend=backend)
+            # Back to (rows, cols, 3) for the writers and display
+            img1 = np.ascontiguousarray(out_soa.transpose(1, 2, 0))
+        else:
+            raise ValueError(f"Unknown layout '{layout}', expected 'aos' or 'soa'")
+
+        if PROFILE:
+            logging.info(f"Image encryption completed in {time.time() - start_time:.2f} seconds")
         return img1
     except Exception as e:
         logging.error(f"Error during encryption: {e}")
@@ -97,94 +141,100 @@ def encrypt_image(img: np.ndarray, key: List[int]) -> np.ndarray:
 def save_image_to_csv(img: np.ndarray, filename: str, rows: int, cols: int):
     """
     Save the image data to a CSV file with dimensions.
+    Large images are formatted in parallel worker processes.
     """
     logging.info(f"Saving image to CSV: {filename}")
     try:
-        start_time = time.time()
-        img_flat = img.reshape(-1, img.shape[-1])
-        with open(filename, 'w') as file:
-            file.write(f"{rows},{cols}\n")
-            np.savetxt(file, img_flat, delimiter=',', fmt='%d')
-        logging.info(f"Image saved to CSV in {time.time() - start_time:.2f} seconds")
+        if PROFILE:
+            start_time = time.time()
+        if img.dtype != np.uint8:
+            raise ValueError(f"Image has dtype {img.dtype}, expected uint8")
+        channels = img.shape[-1]
+        img_flat = img.reshape(-1, channels)
+        # Format a block of pixels at a time and write it with a single call;
+        # blocks are passed as raw bytes so workers never need to import NumPy
+        chunks = [img_flat[start:start + _CSV_CHUNK_ROWS].tobytes()
+                  for start in range(0, len(img_flat), _CSV_CHUNK_ROWS)]
+        workers = os.cpu_count() or 1
+        with open(filename, 'wb') as file:
+            file.write(f"{rows},{cols}\n".encode())
+            if len(img_flat) >= CSV_PARALLEL_MIN_PIXELS and workers > 1:
+                # Text formatting is CPU-bound Python, so use processes to escape the GIL;
+                # map() yields blocks in order so they can be written sequentially
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    for block in executor.map(format_csv_rows, chunks, repeat(channels), chunksize=4):
+                        file.write(block)
+            else:
+                for chunk in chunks:
+                    file.write(format_csv_rows(chunk, channels))
+        if PROFILE:
+            logging.info(f"Image saved to CSV in {time.time() - start_time:.2f} seconds")
     except Exception as e:
         logging.error(f"Failed to save image to CSV: {e}")
         raise
 
+def save_image_to_npy(img: np.ndarray, filename: str):
+    """
+    Save the image data to a binary NumPy (.npy) file.
+    """
+    logging.info(f"Saving image to NPY: {filename}")
+    try:
+        if PROFILE:
+            start_time = time.time()
+        np.save(filename, img.astype(np.uint8, copy=False))
+        if PROFILE:
+            logging.info(f"Image saved to NPY in {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logging.error(f"Failed to save image to NPY: {e}")
+        raise
+
 def save_image_as_png(img: np.ndarray, png_path: str):
     """
     Save the image data as a PNG file.
     """
     logging.info(f"Saving image to PNG: {png_path}")
     try:
-        start_time = time.time()
-        img_to_save = np.clip(img, 0, 255).astype(np.uint8)
-        plt.imsave(png_path, img_to_save)
-        logging.info(f"Image saved to PNG in {time.time() - start_time:.2f} seconds")
+        if PROFILE:
+            start_time = time.time()
+        # uint8 input is already in range; anything else is clipped and cast in one pass
+        if img.dtype == np.uint8:
+            img_to_save = img
+        else:
+            img_to_save = np.clip(img, 0, 255, out=np.empty(img.shape, dtype=np.uint8), casting='unsafe')
+        # Write RGB directly with Pillow; plt.imsave would upcast to RGBA
+        Image.fromarray(img_to_save).save(png_path, format='PNG', compress_level=1)
+        if PROFILE:
+            logging.info(f"Image saved to PNG in {time.time() - start_time:.2f} seconds")
     except Exception as e:
         logging.error(f"Failed to save image as PNG: {e}")
         raise
 
+def get_root():
+    """
+    Return the hidden Tk root window shared by all file dialogs.
+    """
+    global _root
+    if _root is None:
+        _root = tk.Tk()
+        _root.attributes('-topmost', True)  # Make sure dialogs appear on top
+        _root.withdraw()  # Hide the main window
+    return _root
+
 def select_file(title, filetypes):
     """
     Open a dialog to select a file.
     """
-    root = tk.Tk()
-    root.attributes('-topmost', True)  # Make sure dialog appears on top
-    root.withdraw()  # Hide the main window
-    
-    # Force focus on the dialog
+    root = get_root()
     root.focus_force()
-    
-    # Use a callback to ensure the dialog is shown
-    def open_dialog():
-        file_path = filedialog.askopenfilename(title=title, filetypes=filetypes, parent=root)
-        root.file_path = file_path
-        root.quit()
-    
-    # Schedule the dialog to open after the main loop starts
-    root.after(100, open_dialog)
-    
-    # Start the main loop
-    root.mainloop()
-    
-    # Get the selected file path
-    file_path = getattr(root, 'file_path', '')
-    
-    # Destroy the root window
-    root.destroy()
-    
-    return file_path
+    return filedialog.askopenfilename(title=title, filetypes=filetypes, parent=root)
 
 def select_directory(title):
     """
     Open a dialog to select a directory.
     """
-    root = tk.Tk()
-    root.attributes('-topmost', True)  # Make sure dialog appears on top
-    root.withdraw()  # Hide the main window
-    
-    # Force focus on the dialog
+    root = get_root()
     root.focus_force()
-    
-    # Use a callback to ensure the dialog is shown
-    def open_dialog():
-        directory = filedialog.askdirectory(title=title, parent=root)
-        root.directory = directory
-        root.quit()
-    
-    # Schedule the dialog to open after the main loop starts
-    root.after(100, open_dialog)
-    
-    # Start the main loop
-    root.mainloop()
-    
-    # Get the selected directory
-    directory = getattr(root, 'directory', '')
-    
-    # Destroy the root window
-    root.destroy()
-    
-    return directory
+    return filedialog.askdirectory(title=title, parent=root)
 
 def main():
     try:
@@ -222,6 +272,7 @@ def main():
 
         # Define paths for saving files
         key_file_path = os.path.join(output_dir, "key.txt")
+        encrypted_npy_path = os.path.join(output_dir, "encrypted_image.npy")
         encrypted_csv_path = os.path.join(output_dir, "encrypted_image.csv")
         encrypted_png_path = os.path.join(output_dir, "encrypted_image.png")
 
@@ -252,15 +303,24 @@ def main():
             print(f"Error encrypting image: {e}")
             exit(1)
 
-        # Save the encrypted image to CSV
+        # Save the encrypted image to NPY
         try:
-            rows, cols = img.shape[:2]
-            save_image_to_csv(encrypted_img, encrypted_csv_path, rows, cols)
+            save_image_to_npy(encrypted_img, encrypted_npy_path)
         except Exception as e:
-            logging.error(f"Failed to save encrypted image to CSV: {e}")
-            print(f"Error saving encrypted image to CSV: {e}")
+            logging.error(f"Failed to save encrypted image to NPY: {e}")
+            print(f"Error saving encrypted image to NPY: {e}")
             exit(1)
 
+        # Save the encrypted image to CSV for legacy consumers
+        if WRITE_LEGACY_CSV:
+            try:
+                rows, cols = img.shape[:2]
+                save_image_to_csv(encrypted_img, encrypted_csv_path, rows, cols)
+            except Exception as e:
+                logging.error(f"Failed to save encrypted image to CSV: {e}")
+                print(f"Error saving encrypted image to CSV: {e}")
+                exit(1)
+
         # Save the encrypted image as a PNG
         try:
             save_image_as_png(encrypted_img, encrypted_png_path)
@@ -0,0 +1,77 @@
+/*
+ * Optional native lookup-table kernel for img_encrypt.py and img_decrypt.py.
+ *
+ * Maps every byte of a buffer through a 256-entry uint8 table. On CPUs with
+ * AVX-512 VBMI the table is held in four ZMM registers and 64 bytes are mapped
+ * per iteration with two VPERMI2B permutes and a blend; otherwise a scalar
+ * loop is used.
+ *
+ * Build (optional, the scripts fall back to NumPy/Numba without it):
+ *     cc -O3 -shared -fPIC -o liblut_apply.so lut_apply.c
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+
+#if defined(__x86_64__) && (defined(__GNUC__) || defined(__clang__))
+#include <immintrin.h>
+#define HAVE_VBMI_KERNEL 1
+#endif
+
+static void apply_lut_scalar(const uint8_t *lut, const uint8_t *in, uint8_t *out, size_t n)
+{
+    for (size_t i = 0; i < n; i++) {
+        out[i] = lut[in[i]];
+    }
+}
+
+#ifdef HAVE_VBMI_KERNEL
+__attribute__((target("avx512f,avx512bw,avx512vbmi")))
+static void apply_lut_vbmi(const uint8_t *lut, const uint8_t *in, uint8_t *out, size_t n)
+{
+    const __m512i t0 = _mm512_loadu_si512((const void *)(lut));
+    const __m512i t1 = _mm512_loadu_si512((const void *)(lut + 64));
+    const __m512i t2 = _mm512_loadu_si512((const void *)(lut + 128));
+    const __m512i t3 = _mm512_loadu_si512((const void *)(lut + 192));
+    size_t i = 0;
+
+    for (; i + 64 <= n; i += 64) {
+        __m512i idx = _mm512_loadu_si512((const void *)(in + i));
+        /* Each permute uses the low 7 bits: table entries 0-127 and 128-255 */
+        __m512i lo = _mm512_permutex2var_epi8(t0, idx, t1);
+        __m512i hi = _mm512_permutex2var_epi8(t2, idx, t3);
+        /* Bit 7 of each index selects the upper half of the table */
+        __mmask64 upper = _mm512_movepi8_mask(idx);
+        _mm512_storeu_si512((void *)(out + i), _mm512_mask_blend_epi8(upper, lo, hi));
+    }
+
+    apply_lut_scalar(lut, in + i, out + i, n - i);
+}
+#endif
+
+/* Return 1 if the AVX-512 VBMI kernel can run on this CPU, 0 otherwise. */
+int lut_apply_has_vbmi(void)
+{
+#ifdef HAVE_VBMI_KERNEL
+    static int cached = -1;
+    if (cached < 0) {
+        __builtin_cpu_init();
+        cached = __builtin_cpu_supports("avx512bw") && __builtin_cpu_supports("avx512vbmi");
+    }
+    return cached;
+#else
+    return 0;
+#endif
+}
+
+/* out[i] = lut[in[i]] for i in [0, n). lut must hold 256 entries. */
+void apply_lut(const uint8_t *lut, const uint8_t *in, uint8_t *out, size_t n)
+{
+#ifdef HAVE_VBMI_KERNEL
+    if (lut_apply_has_vbmi()) {
+        apply_lut_vbmi(lut, in, out, n);
+        return;
+    }
+#endif
+    apply_lut_scalar(lut, in, out, n);
+}
@@ -0,0 +1,128 @@
+"""
+Lookup-Table Kernels
+
+Shared helpers used by img_encrypt.py and img_decrypt.py to map every pixel
+value through a 256-entry uint8 key. The fastest available backend is picked
+at call time: CuPy on a CUDA GPU, the native AVX-512 VBMI kernel built from
+lut_apply.c, a parallel Numba kernel, or plain NumPy.
+
+Author: Mohammad Shadman Khan
+"""
+
+import numpy as np
+import ctypes
+import logging
+import os
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+# Whether a CUDA device is usable, probed the first time an image is large enough
+_gpu_available = None
+
+# Smallest image (in bytes) worth handing to the native lookup-table kernel
+NATIVE_LUT_MIN_BYTES = 1 << 16
+
+# Smallest image (in bytes) worth the host/GPU round trip when CuPy is available.
+# This only covers the transfers: the one-off CUDA context setup and kernel
+# compile on the first call are not included
+GPU_LUT_MIN_BYTES = 1_000_000
+
+# Smallest image (in bytes) for which the parallel Numba kernel pays back the
+# ~0.15 s it takes to load its cached machine code on the first call
+NUMBA_LUT_MIN_BYTES = 64 << 20
+
+def load_lut_library():
+    """
+    Load the optional native lookup-table kernel built from lut_apply.c.
+    Returns None if the library is not built or the CPU lacks AVX-512 VBMI.
+    """
+    lib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'liblut_apply.so')
+    if not os.path.exists(lib_path):
+        return None
+    try:
+        lib = ctypes.CDLL(lib_path)
+    except OSError as e:
+        logging.warning(f"Failed to load {lib_path}: {e}")
+        return None
+    lib.apply_lut.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+    lib.apply_lut.restype = None
+    lib.lut_apply_has_vbmi.restype = ctypes.c_int
+    if not lib.lut_apply_has_vbmi():
+        return None
+    return lib
+
+_lut_lib = load_lut_library()
+
+def gpu_available() -> bool:
+    """
+    Return True if CuPy is installed and a CUDA device can be used.
+    The device is only probed on the first call.
+    """
+    global _gpu_available
+    if _gpu_available is None:
+        _gpu_available = cp is not None and cp.cuda.is_available()
+    return _gpu_available
+
+if numba is not None:
+    @numba.njit(parallel=True, boundscheck=False, cache=True)
+    def _apply_lut_parallel(out, img, lut):
+        # Every byte is an independent lookup, so split them across all cores
+        for i in numba.prange(img.size):
+            out[i] = lut[img[i]]
+
+def select_lut_backend(img: np.ndarray) -> str:
+    """
+    Pick the lookup backend for a whole image: 'gpu', 'native', 'numba' or 'numpy'.
+    Callers that process an image in blocks should pick once and pass it on,
+    so the size thresholds apply to the image rather than to each block.
+    """
+    if img.nbytes > GPU_LUT_MIN_BYTES and gpu_available():
+        return 'gpu'
+    if _lut_lib is not None and img.nbytes > NATIVE_LUT_MIN_BYTES:
+        return 'native'
+    if numba is not None and img.nbytes > NUMBA_LUT_MIN_BYTES:
+        return 'numba'
+    return 'numpy'
+
+def apply_lut(img: np.ndarray, lut: np.ndarray, out: np.ndarray = None,
+              backend: str = None) -> np.ndarray:
+    """
+    Map every pixel value through a 256-entry uint8 lookup table.
+    The backend is chosen with select_lut_backend unless one is given.
+    Raises ValueError for anything but uint8 input.
+    """
+    # Every backend indexes the table directly, and they would disagree on
+    # out-of-range values (NumPy clips, CuPy wraps, the CPU kernels read past
+    # the table), so only uint8 input, which can never exceed 255, is accepted
+    if img.dtype != np.uint8:
+        raise ValueError(f"Lookup input has dtype {img.dtype}, expected uint8")
+    if backend is None:
+        backend = select_lut_backend(img)
+    if out is None:
+        out = np.empty(img.shape, dtype=np.uint8)
+    # Unit-stride input lets every path stream through memory
+    img = np.ascontiguousarray(img)
+    if not out.flags.c_contiguous:
+        backend = 'numpy'
+    if backend == 'gpu':
+        # One thread per byte on the device, then copy straight into out
+        d_out = cp.take(cp.asarray(lut, dtype=cp.uint8), cp.asarray(img))
+        d_out.get(out=out)
+    elif backend == 'native':
+        lut = np.ascontiguousarray(lut, dtype=np.uint8)
+        _lut_lib.apply_lut(lut.ctypes.data, img.ctypes.data, out.ctypes.data, img.size)
+    elif backend == 'numba':
+        _apply_lut_parallel(out.reshape(-1), img.reshape(-1), lut)
+    else:
+        # mode='clip' writes into out directly instead of through a temporary;
+        # it never clips anything since uint8 indices are always in range
+        np.take(lut, img, out=out, mode='clip')
+    return out